@@ -0,0 +1,114 @@
+# archive.py
+# =============================================
+# 卡密归档与空间回收
+# =============================================
+# cards 表会一直保留所有发出去的卡密，活动办得越多，表越大，
+# 分配卡密、统计库存、分页查询都会越来越慢，数据库文件也越来越大。
+#
+# 这里把"已使用很久"的卡密分批搬到 cards_archive 表：
+# - 每一批单独提交，不会长时间锁住数据库，领取可以照常进行
+# - 搬完后用 PRAGMA incremental_vacuum 一点点把空间还给磁盘（无需停机）
+# - 按用户查卡密、导出卡密时会同时查询两张表，归档的数据不会丢
+
+import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session, sessionmaker
+
+import models
+import config
+
+
+def archive_used_cards(
+    db: Session,
+    older_than_days: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> int:
+    """
+    把使用时间早于 N 天前的卡密搬到归档表
+
+    返回归档的卡密数量
+    """
+    if older_than_days is None:
+        older_than_days = config.ARCHIVE_AFTER_DAYS
+    if batch_size is None:
+        batch_size = config.ARCHIVE_BATCH_SIZE
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+    archived_at = datetime.datetime.now()
+    total = 0
+
+    while True:
+        cards = db.query(models.Card).filter(
+            models.Card.is_used == True,
+            models.Card.used_at < cutoff
+        ).order_by(models.Card.id).limit(batch_size).all()
+
+        if not cards:
+            break
+
+        # 同一批的"复制"和"删除"在一个事务里完成，不会出现两边都有或都没有的情况
+        db.bulk_insert_mappings(models.ArchivedCard, [
+            {
+                "card_id": card.id,
+                "code": card.code,
+                "value": card.value,
+                "used_by": card.used_by,
+                "used_at": card.used_at,
+                "archived_at": archived_at,
+            }
+            for card in cards
+        ])
+        db.query(models.Card).filter(
+            models.Card.id.in_([card.id for card in cards])
+        ).delete(synchronize_session=False)
+        db.commit()
+        db.expunge_all()
+
+        total += len(cards)
+
+    return total
+
+
+def reclaim_space(db: Session, pages_per_step: Optional[int] = None) -> int:
+    """
+    分步回收数据库里的空闲页
+    （需要数据库处于增量回收模式，旧数据库要先用 database.convert_to_incremental_vacuum 切换）
+
+    每一步只回收一小部分，中间可以穿插其它读写，返回回收的页数
+    """
+    if pages_per_step is None:
+        pages_per_step = config.VACUUM_PAGES_PER_STEP
+
+    reclaimed = 0
+    while True:
+        free_pages = db.execute(text("PRAGMA freelist_count")).scalar()
+        if not free_pages:
+            break
+
+        step = min(free_pages, pages_per_step)
+        # incremental_vacuum 每回收一页执行一步，Python 的 sqlite3 用 execute 只会执行第一步（只回收一页），
+        # executescript 才会把整条语句执行完，所以这里直接用底层的 sqlite3 连接
+        db.commit()
+        db.connection().connection.executescript(f"PRAGMA incremental_vacuum({step});")
+
+        after = db.execute(text("PRAGMA freelist_count")).scalar()
+        if after >= free_pages:
+            # 没有进展（例如数据库不是增量回收模式），直接结束
+            break
+        reclaimed += free_pages - after
+
+    return reclaimed
+
+
+def reclaim_space_in_background(session_factory: sessionmaker) -> None:
+    """在请求返回之后回收空间，使用单独的会话（给 BackgroundTasks 调用）"""
+    db = session_factory()
+    try:
+        pages = reclaim_space(db)
+        print(f"归档后回收了 {pages} 页磁盘空间")
+    except Exception as e:
+        print(f"回收磁盘空间失败: {e}")
+    finally:
+        db.close()
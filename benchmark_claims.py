@@ -0,0 +1,75 @@
+# benchmark_claims.py
+# =============================================
+# 领取压力测试
+# =============================================
+# 模拟很多人同时领取，对比"逐个提交"和"批量提交"每秒能处理多少次领取
+# 测试在临时目录里进行，不会影响真实的数据库
+#
+# 用法: python benchmark_claims.py [领取人数] [并发线程数]
+# 例如: python benchmark_claims.py 2000 32
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="claim-bench-"))
+
+import config
+import main
+import models
+import schemas
+import campaigns
+import profiling
+
+
+def prepare(name: str, users: int) -> None:
+    """创建一个活动，导入用户和刚好够用的卡密（每人 18 = 10 + 5 + 3）"""
+    campaigns.create_campaign(name)
+    db = campaigns.get_sessionmaker(name)()
+    try:
+        db.bulk_insert_mappings(models.User, [
+            {"ycy_uid": f"u{i}", "nickname": f"用户{i}", "qq": str(i), "zhihe_count": 18, "has_claimed": False}
+            for i in range(users)
+        ])
+        for value in (10, 5, 3):
+            db.bulk_insert_mappings(models.Card, [
+                {"code": f"{name}-{value}-{i}", "value": value, "is_used": False}
+                for i in range(users)
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def run(name: str, users: int, threads: int, group: bool) -> None:
+    config.GROUP_COMMIT_ENABLED = group
+    session_factory = campaigns.get_sessionmaker(name)
+
+    def claim(i: int) -> bool:
+        db = session_factory()
+        try:
+            request = schemas.ClaimRequest(ycy_uid=f"u{i}", qq=str(i))
+            return main.process_claim(request, db, profiling.NULL_TIMER).success
+        finally:
+            db.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(claim, range(users)))
+    elapsed = time.perf_counter() - start
+
+    mode = "批量提交" if group else "逐个提交"
+    print(f"{mode}: {sum(results)}/{users} 成功, 用时 {elapsed:.2f}s, {users / elapsed:.0f} 次/秒")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+    prepare("bench_single", users)
+    prepare("bench_group", users)
+    run("bench_single", users, threads, group=False)
+    run("bench_group", users, threads, group=True)
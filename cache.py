@@ -0,0 +1,342 @@
+# cache.py
+# =============================================
+# 共享缓存 / 计数器 / 锁 (可插拔后端)
+# =============================================
+# 多个 uvicorn worker 或多个容器同时运行时，每个进程自己的内存互相看不到，
+# 所以缓存、计数器、锁都需要放在一个"大家都能访问"的地方。
+#
+# 这里提供两种后端，接口完全一样：
+# - LocalBackend: 进程内实现，单进程部署或测试时使用（默认）
+# - RedisBackend: 通过 Redis 协议访问外部服务，多进程/多容器部署时使用
+#   任何兼容 Redis 协议的服务都可以（Redis / KeyDB / Valkey 等），不需要额外安装 Python 库
+
+import json
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import config
+
+
+# 缓存后端不可用时（连接失败、超时、Redis 返回错误）可能抛出的异常
+BACKEND_ERRORS = (ConnectionError, OSError, RuntimeError)
+
+
+class LockTimeout(Exception):
+    """在规定时间内没有拿到锁"""
+
+
+class LockUnavailable(Exception):
+    """缓存后端不可用，没法加锁"""
+
+
+class CacheBackend:
+    """
+    缓存后端的公共接口
+
+    子类只需要实现下面几个基础操作，lock / get_json / set_json 等都建立在它们之上
+    """
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """只有 key 不存在时才写入，写入成功返回 True（用于实现锁）"""
+        raise NotImplementedError
+
+    def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """
+        原子地给计数器加上 amount，返回加完之后的值
+
+        ttl 只在计数器第一次创建时生效，适合做"每分钟最多 N 次"这类限流
+        """
+        raise NotImplementedError
+
+    def delete_if_equals(self, key: str, value: str) -> bool:
+        """只有 key 当前的值等于 value 时才删除（用于安全地释放锁）"""
+        raise NotImplementedError
+
+    # ---------- 以下是通用的辅助方法 ----------
+
+    def get_json(self, key: str) -> Any:
+        raw = self.get(key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def set_json(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(key, json.dumps(value, ensure_ascii=False), ttl)
+
+    @contextmanager
+    def lock(self, key: str, timeout: float = 10, wait: float = 5) -> Iterator[None]:
+        """
+        分布式锁
+
+        - timeout: 锁最长持有时间，防止进程崩溃后锁永远不释放
+        - wait: 最多等待多久，超过就抛出 LockTimeout
+        - 缓存后端不可用时抛出 LockUnavailable，调用方可以决定不加锁继续
+        """
+        lock_key = f"lock:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        delay = 0.001
+
+        while True:
+            try:
+                if self.add(lock_key, token, timeout):
+                    break
+            except BACKEND_ERRORS as e:
+                raise LockUnavailable(key) from e
+            if time.monotonic() >= deadline:
+                raise LockTimeout(key)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        try:
+            yield
+        finally:
+            # 释放失败时锁会在 timeout 之后自动过期，不能让已经做完的操作报错
+            try:
+                self.delete_if_equals(lock_key, token)
+            except BACKEND_ERRORS as e:
+                print(f"释放锁失败: {key}: {e}")
+
+
+class LocalBackend(CacheBackend):
+    """进程内后端：数据保存在一个字典里，用线程锁保证原子性"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._mutex = threading.Lock()
+
+    def _get_alive(self, key: str) -> Optional[str]:
+        # 调用方需要先持有 self._mutex
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    @staticmethod
+    def _expires_at(ttl: Optional[float]) -> Optional[float]:
+        return time.monotonic() + ttl if ttl else None
+
+    def get(self, key: str) -> Optional[str]:
+        with self._mutex:
+            return self._get_alive(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        with self._mutex:
+            self._data[key] = (value, self._expires_at(ttl))
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        with self._mutex:
+            if self._get_alive(key) is not None:
+                return False
+            self._data[key] = (value, self._expires_at(ttl))
+            return True
+
+    def delete(self, *keys: str) -> None:
+        with self._mutex:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        with self._mutex:
+            current = self._get_alive(key)
+            if current is None:
+                self._data[key] = (str(amount), self._expires_at(ttl))
+                return amount
+            value = int(current) + amount
+            self._data[key] = (str(value), self._data[key][1])
+            return value
+
+    def delete_if_equals(self, key: str, value: str) -> bool:
+        with self._mutex:
+            if self._get_alive(key) != value:
+                return False
+            del self._data[key]
+            return True
+
+
+class RedisBackend(CacheBackend):
+    """
+    Redis 协议后端
+
+    自己实现了最简单的 RESP 协议客户端，每个线程一条连接
+    命令还没发出去时发现连接已断开，会自动重连重试一次（见 execute）
+    """
+
+    # 比较后删除的 Lua 脚本，保证释放锁时不会误删别人的锁
+    _DELETE_IF_EQUALS = (
+        "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+        "return redis.call('DEL', KEYS[1]) else return 0 end"
+    )
+
+    # 计数器第一次创建时设置过期时间
+    _INCR_WITH_TTL = (
+        "local v = redis.call('INCRBY', KEYS[1], ARGV[1]) "
+        "if v == tonumber(ARGV[1]) and tonumber(ARGV[2]) > 0 then "
+        "redis.call('PEXPIRE', KEYS[1], ARGV[2]) end return v"
+    )
+
+    def __init__(self, url: str, socket_timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.socket_timeout = socket_timeout
+        self._local = threading.local()
+
+    # ---------- 连接与协议 ----------
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout)
+        conn = (sock, sock.makefile("rb"))
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.password:
+                self._send(conn, "AUTH", self.password)
+            if self.db:
+                self._send(conn, "SELECT", self.db)
+        except Exception:
+            # 认证或选库失败时不能把这条连接留给后面的命令使用
+            self._close_conn(conn)
+            raise
+        self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _close_conn(conn) -> None:
+        try:
+            conn[1].close()
+            conn[0].close()
+        except OSError:
+            pass
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            self._close_conn(conn)
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis 连接已断开")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RuntimeError(f"Redis 错误: {payload.decode('utf-8')}")
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"无法识别的 Redis 回复: {line!r}")
+
+    def _send(self, conn, *args):
+        sock, reader = conn
+        sock.sendall(self._encode(args))
+        return self._read_reply(reader)
+
+    def execute(self, *args):
+        """
+        发送一条命令并返回结果
+
+        只有命令还没发出去就失败时（例如空闲连接已经被服务端关掉）才重连重试一次；
+        命令发出去之后再出错（读超时、连接断开）不能重试，
+        因为服务端可能已经执行过了，INCRBY 之类的命令重试会被执行两次
+        """
+        payload = self._encode(args)
+        for attempt in range(2):
+            sent = False
+            try:
+                conn = getattr(self._local, "conn", None)
+                if conn is None:
+                    conn = self._connect()
+                conn[0].sendall(payload)
+                sent = True
+                return self._read_reply(conn[1])
+            except (ConnectionError, OSError):
+                # 连接状态已经不确定，丢掉它，下一条命令会重新连接
+                self._close()
+                if sent or attempt == 1:
+                    raise
+
+    # ---------- 基础操作 ----------
+
+    @staticmethod
+    def _ttl_args(ttl: Optional[float]) -> List[Any]:
+        return ["PX", max(1, int(ttl * 1000))] if ttl else []
+
+    def get(self, key: str) -> Optional[str]:
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.execute("SET", key, value, *self._ttl_args(ttl))
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        return self.execute("SET", key, value, "NX", *self._ttl_args(ttl)) == "OK"
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.execute("DEL", *keys)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        if not ttl:
+            return self.execute("INCRBY", key, amount)
+        return self.execute("EVAL", self._INCR_WITH_TTL, 1, key, amount, int(ttl * 1000))
+
+    def delete_if_equals(self, key: str, value: str) -> bool:
+        return self.execute("EVAL", self._DELETE_IF_EQUALS, 1, key, value) == 1
+
+
+def create_backend(url: str) -> CacheBackend:
+    """
+    根据配置创建缓存后端
+
+    - 空字符串 / "local": 进程内后端
+    - "redis://[:密码@]主机:端口/库号": Redis 协议后端
+    """
+    if not url or url == "local":
+        return LocalBackend()
+    if url.startswith("redis://"):
+        return RedisBackend(url)
+    raise ValueError(f"不支持的缓存地址: {url}")
+
+
+# 全局使用的缓存后端，整个程序共享这一个
+backend: CacheBackend = create_backend(config.CACHE_URL)
@@ -0,0 +1,110 @@
+# campaigns.py
+# =============================================
+# 多活动支持
+# =============================================
+# 每个活动（campaign）都有自己独立的 SQLite 数据库文件，里面有自己的用户表和卡密表：
+# - 默认活动 "default" 使用原来的 ./database.db，老数据不需要迁移
+# - 其它活动保存在 ./campaigns/<活动名>.db
+#
+# 分成多个文件的好处是：一个活动开抢时的写入高峰只会锁住它自己的数据库，
+# 不会影响其它活动的领取和后台操作。
+#
+# 每个活动的会话工厂只创建一次并保存在字典里，领取时只需要查一次字典
+
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import database
+
+
+DEFAULT_CAMPAIGN = "default"
+
+# 其它活动的数据库文件放在这个目录下
+CAMPAIGN_DIR = "./campaigns"
+
+# 活动名只允许字母、数字、下划线和短横线，防止拼出奇怪的文件路径
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# {活动名: 会话工厂}
+_sessionmakers: Dict[str, sessionmaker] = {}
+_registry_lock = threading.Lock()
+
+
+def is_valid_name(name: str) -> bool:
+    return bool(_NAME_PATTERN.match(name))
+
+
+def _db_path(name: str) -> str:
+    return os.path.join(CAMPAIGN_DIR, f"{name}.db")
+
+
+def _open(name: str, engine) -> sessionmaker:
+    """初始化数据库并登记会话工厂，调用方需要先持有 _registry_lock"""
+    database.enable_incremental_vacuum(engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    # info 里记录活动名，缓存的 key 会按活动区分（见 crud.py）
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"campaign": name})
+    _sessionmakers[name] = factory
+    return factory
+
+
+def _open_file(name: str) -> sessionmaker:
+    engine = create_engine(
+        f"sqlite:///{_db_path(name)}", connect_args={"check_same_thread": False}
+    )
+    return _open(name, engine)
+
+
+def init_campaigns() -> None:
+    """程序启动时调用：打开默认活动和 campaigns 目录下已有的所有活动"""
+    with _registry_lock:
+        _open(DEFAULT_CAMPAIGN, database.engine)
+        if os.path.isdir(CAMPAIGN_DIR):
+            for filename in sorted(os.listdir(CAMPAIGN_DIR)):
+                name, ext = os.path.splitext(filename)
+                if ext == ".db" and is_valid_name(name) and name not in _sessionmakers:
+                    _open_file(name)
+
+
+def get_sessionmaker(name: str) -> Optional[sessionmaker]:
+    """
+    获取某个活动的会话工厂，活动不存在时返回 None
+
+    其它 worker 进程新建的活动，这里第一次访问时会自动打开
+    """
+    factory = _sessionmakers.get(name)
+    if factory is not None:
+        return factory
+
+    if name == DEFAULT_CAMPAIGN or not is_valid_name(name) or not os.path.exists(_db_path(name)):
+        return None
+    with _registry_lock:
+        return _sessionmakers.get(name) or _open_file(name)
+
+
+def create_campaign(name: str) -> bool:
+    """创建新活动，活动已存在时返回 False"""
+    with _registry_lock:
+        if name in _sessionmakers or os.path.exists(_db_path(name)):
+            return False
+        os.makedirs(CAMPAIGN_DIR, exist_ok=True)
+        _open_file(name)
+        return True
+
+
+def list_campaigns() -> List[str]:
+    """列出所有活动（包括其它进程新建的）"""
+    names = {DEFAULT_CAMPAIGN}
+    if os.path.isdir(CAMPAIGN_DIR):
+        for filename in os.listdir(CAMPAIGN_DIR):
+            name, ext = os.path.splitext(filename)
+            if ext == ".db" and is_valid_name(name):
+                names.add(name)
+    return sorted(names, key=lambda n: (n != DEFAULT_CAMPAIGN, n))
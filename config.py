@@ -10,3 +10,65 @@ VERSION = "2.0.0"
 # 请修改下面的引号里的内容，设置你的后台密码
 # 默认密码是: admin1234
 ADMIN_PASSWORD = "admin1234"
+
+# ==============================
+#      低库存水位线设置
+# ==============================
+# 某种面值的剩余库存低于这里的数量时，后台库存规划会发出提醒
+# 格式: {面值: 张数}
+LOW_STOCK_WATERMARKS = {10: 50, 5: 50, 3: 50, 1: 50}
+
+# ==============================
+#      共享缓存设置
+# ==============================
+# 缓存/计数器/锁存放的位置
+# - 留空: 使用进程内缓存（只启动一个进程时使用）
+# - 多个 worker 或多个容器部署时，请填写 Redis 地址，例如 "redis://127.0.0.1:6379/0"
+CACHE_URL = ""
+
+# 用户信息缓存多少秒
+USER_CACHE_TTL = 300
+
+# 统计数据（库存、用户数）缓存多少秒
+STATS_CACHE_TTL = 5
+
+# 同一个UID每分钟最多尝试领取多少次，0 表示不限制
+CLAIM_RATE_LIMIT_PER_MINUTE = 0
+
+# ==============================
+#      性能分析设置
+# ==============================
+# 是否开启性能分析（领取流程分阶段计时、慢请求日志、采样分析接口）
+# 平时请保持关闭，排查问题时再打开
+PROFILING_ENABLED = False
+
+# 领取请求超过多少毫秒会被记录到慢请求日志
+SLOW_REQUEST_MS = 500
+
+# ==============================
+#      卡密归档设置
+# ==============================
+# 已使用超过多少天的卡密会被归档（搬到归档表，不再占用主表）
+ARCHIVE_AFTER_DAYS = 30
+
+# 每批归档多少张卡密，批次越小，每次占用数据库的时间越短
+ARCHIVE_BATCH_SIZE = 500
+
+# 每次回收多少页磁盘空间（SQLite 一页通常是 4KB）
+VACUUM_PAGES_PER_STEP = 1000
+
+# ==============================
+#      批量提交设置
+# ==============================
+# 是否开启批量提交：多个领取请求合并成一个事务写入数据库，
+# 领取人数很多时可以大幅提高每秒处理的领取次数（每个请求仍然是写入磁盘后才返回）
+GROUP_COMMIT_ENABLED = False
+
+# 每批最多合并多少个领取请求
+GROUP_COMMIT_MAX_BATCH = 64
+
+# 每批最多等待多少毫秒
+GROUP_COMMIT_MAX_DELAY_MS = 5
+
+# 领取请求最多等待批量提交多少秒，超时时还没开始处理的请求会被取消（不会再写入）
+GROUP_COMMIT_TIMEOUT_SECONDS = 10
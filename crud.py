@@ -6,9 +6,94 @@
 
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Iterator
 import models
 import schemas
+import cache
+import config
+import profiling
+import campaigns
+
+
+# 系统支持的卡密面值（从大到小）
+CARD_VALUES = [10, 5, 3, 1]
+
+
+# =============================================
+# 缓存相关
+# =============================================
+# 缓存放在共享后端里（见 cache.py），多个进程看到的是同一份数据
+# 数据库里的数据一旦修改，就要删除对应的缓存
+# 每个活动的数据是分开的（见 campaigns.py），所以缓存的 key 前面都带上活动名
+
+STOCK_CACHE_KEY = "stats:stock"
+USER_COUNTS_CACHE_KEY = "stats:users"
+
+
+def campaign_of(db: Session) -> str:
+    """当前会话属于哪个活动"""
+    return db.info.get("campaign", campaigns.DEFAULT_CAMPAIGN)
+
+
+def _cache_key(db: Session, key: str) -> str:
+    return f"{campaign_of(db)}:{key}"
+
+
+def _user_cache_key(db: Session, ycy_uid: str) -> str:
+    return _cache_key(db, f"user:{ycy_uid}")
+
+
+def user_snapshot(user: models.User) -> dict:
+    """把用户信息转换成可以放进缓存的字典"""
+    return {
+        "nickname": user.nickname,
+        "qq": user.qq,
+        "zhihe_count": user.zhihe_count,
+        "has_claimed": bool(user.has_claimed),
+    }
+
+
+# 写缓存、删缓存都发生在数据库提交之后，数据库才是准的：
+# 缓存后端出错时只记录下来，不能让已经成功的操作变成失败（过期的缓存最多保留 TTL 那么久）
+
+def _try_set_json(key: str, value, ttl: float) -> None:
+    try:
+        cache.backend.set_json(key, value, ttl)
+    except Exception as e:
+        print(f"写入缓存失败: {key}: {e}")
+
+
+def _try_delete(*keys: str) -> None:
+    try:
+        cache.backend.delete(*keys)
+    except Exception as e:
+        print(f"删除缓存失败: {keys}: {e}")
+
+
+def invalidate_user_cache(db: Session, *ycy_uids: str) -> None:
+    """用户数据有变化时，删除相关缓存"""
+    _try_delete(
+        _cache_key(db, USER_COUNTS_CACHE_KEY),
+        *[_user_cache_key(db, uid) for uid in ycy_uids]
+    )
+
+
+def invalidate_stock_cache(db: Session) -> None:
+    """卡密数据有变化时，删除库存缓存"""
+    _try_delete(_cache_key(db, STOCK_CACHE_KEY))
+
+
+def hit_claim_rate_limit(db: Session, ycy_uid: str) -> bool:
+    """记录一次领取尝试，超过每分钟上限时返回 True"""
+    limit = config.CLAIM_RATE_LIMIT_PER_MINUTE
+    if limit <= 0:
+        return False
+    try:
+        return cache.backend.incr(_cache_key(db, f"ratelimit:claim:{ycy_uid}"), 1, ttl=60) > limit
+    except cache.BACKEND_ERRORS as e:
+        # 缓存后端不可用时不限流，不能因此让所有人都领不了
+        print(f"限流计数失败: {e}")
+        return False
 
 
 # =============================================
@@ -20,6 +105,48 @@ def get_user_by_uid(db: Session, ycy_uid: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.ycy_uid == ycy_uid).first()
 
 
+def get_users_by_uids(db: Session, ycy_uids: List[str]) -> Dict[str, models.User]:
+    """一次查询多个用户，返回 {UID: 用户}"""
+    users = db.query(models.User).filter(models.User.ycy_uid.in_(ycy_uids)).all()
+    return {user.ycy_uid: user for user in users}
+
+
+def get_user_snapshot(db: Session, ycy_uid: str) -> Optional[dict]:
+    """
+    通过易次元UID获取用户信息（优先读缓存）
+
+    返回的是字典而不是数据库对象，用户不存在时返回 None
+    找不到的UID也会被缓存，防止反复输错UID时一直查数据库
+    缓存后端不可用时直接查数据库
+    """
+    key = _user_cache_key(db, ycy_uid)
+    try:
+        snapshot = cache.backend.get_json(key)
+    except cache.BACKEND_ERRORS as e:
+        print(f"读取缓存失败: {key}: {e}")
+        user = get_user_by_uid(db, ycy_uid)
+        return user_snapshot(user) if user else None
+
+    if snapshot is None:
+        user = get_user_by_uid(db, ycy_uid)
+        snapshot = user_snapshot(user) if user else {}
+        _try_set_json(key, snapshot, config.USER_CACHE_TTL)
+    return snapshot or None
+
+
+def get_user_counts(db: Session) -> Dict[str, int]:
+    """获取用户总数和已领取人数（带缓存）"""
+    key = _cache_key(db, USER_COUNTS_CACHE_KEY)
+    counts = cache.backend.get_json(key)
+    if counts is None:
+        counts = {
+            "total": db.query(models.User).count(),
+            "claimed": db.query(models.User).filter(models.User.has_claimed == True).count(),
+        }
+        cache.backend.set_json(key, counts, config.STATS_CACHE_TTL)
+    return counts
+
+
 def get_users_paginated(db: Session, page: int, page_size: int) -> Tuple[List[models.User], int]:
     """分页获取用户列表"""
     total = db.query(models.User).count()
@@ -37,6 +164,7 @@ def create_or_update_user(db: Session, user_data: schemas.UserImport) -> models.
         existing.zhihe_count = user_data.zhihe
         db.commit()
         db.refresh(existing)
+        invalidate_user_cache(db, existing.ycy_uid)
         return existing
     else:
         new_user = models.User(
@@ -49,6 +177,7 @@ def create_or_update_user(db: Session, user_data: schemas.UserImport) -> models.
         db.add(new_user)
         db.commit()
         db.refresh(new_user)
+        invalidate_user_cache(db, new_user.ycy_uid)
         return new_user
 
 
@@ -71,9 +200,22 @@ def update_user(db: Session, user_id: int, data: schemas.UserUpdate) -> Optional
     
     db.commit()
     db.refresh(user)
+    invalidate_user_cache(db, user.ycy_uid)
     return user
 
 
+def get_pending_zhihe_distribution(db: Session) -> Dict[int, int]:
+    """统计未领取用户的应得纸鹤分布，返回 {纸鹤数: 人数}"""
+    rows = db.query(models.User.zhihe_count, func.count(models.User.id)).filter(
+        models.User.has_claimed == False
+    ).group_by(models.User.zhihe_count).all()
+    result = {}
+    for zhihe, count in rows:
+        key = zhihe or 0
+        result[key] = result.get(key, 0) + count
+    return result
+
+
 def delete_user(db: Session, user_id: int) -> bool:
     """删除用户"""
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -81,6 +223,7 @@ def delete_user(db: Session, user_id: int) -> bool:
         return False
     db.delete(user)
     db.commit()
+    invalidate_user_cache(db, user.ycy_uid)
     return True
 
 
@@ -93,9 +236,20 @@ def get_cards_paginated(
     page: int, 
     page_size: int,
     value: Optional[int] = None,
-    used: Optional[bool] = None
+    used: Optional[bool] = None,
+    archived: bool = False
 ) -> Tuple[List[models.Card], int]:
-    """分页获取卡密列表（可筛选）"""
+    """分页获取卡密列表（可筛选），archived=True 时查询归档表"""
+    if archived:
+        query = db.query(models.ArchivedCard)
+        if value is not None:
+            query = query.filter(models.ArchivedCard.value == value)
+        if used is False:
+            return [], 0
+        total = query.count()
+        cards = query.order_by(models.ArchivedCard.id).offset((page - 1) * page_size).limit(page_size).all()
+        return cards, total
+
     query = db.query(models.Card)
     
     if value is not None:
@@ -116,14 +270,16 @@ def add_cards(db: Session, content: str, value: int) -> int:
     for line in lines:
         code = line.strip()
         if code:
-            # 检查是否已存在
-            existing = db.query(models.Card).filter(models.Card.code == code).first()
+            # 检查是否已存在（包括已归档的卡密）
+            existing = db.query(models.Card).filter(models.Card.code == code).first() or \
+                db.query(models.ArchivedCard).filter(models.ArchivedCard.code == code).first()
             if not existing:
                 card = models.Card(code=code, value=value, is_used=False)
                 db.add(card)
                 count += 1
     
     db.commit()
+    invalidate_stock_cache(db)
     return count
 
 
@@ -145,6 +301,7 @@ def update_card(db: Session, card_id: int, data: schemas.CardUpdate) -> Optional
     
     db.commit()
     db.refresh(card)
+    invalidate_stock_cache(db)
     return card
 
 
@@ -155,18 +312,52 @@ def delete_card(db: Session, card_id: int) -> bool:
         return False
     db.delete(card)
     db.commit()
+    invalidate_stock_cache(db)
     return True
 
 
+def get_cards_by_user(db: Session, ycy_uid: str) -> List[models.Card]:
+    """查询某个用户领到的所有卡密（包括已归档的）"""
+    cards = db.query(models.Card).filter(models.Card.used_by == ycy_uid).all()
+    archived = db.query(models.ArchivedCard).filter(models.ArchivedCard.used_by == ycy_uid).all()
+    return cards + archived
+
+
+def iter_cards_for_export(
+    db: Session,
+    value: Optional[int] = None,
+    used: Optional[bool] = None
+) -> Iterator[models.Card]:
+    """逐条读取要导出的卡密，已使用的卡密会连同归档表一起导出"""
+    query = db.query(models.Card)
+    if value is not None:
+        query = query.filter(models.Card.value == value)
+    if used is not None:
+        query = query.filter(models.Card.is_used == used)
+    yield from query.order_by(models.Card.id).yield_per(1000)
+
+    if used is not False:
+        archived = db.query(models.ArchivedCard)
+        if value is not None:
+            archived = archived.filter(models.ArchivedCard.value == value)
+        yield from archived.order_by(models.ArchivedCard.id).yield_per(1000)
+
+
 def get_available_cards_count(db: Session) -> Dict[str, int]:
-    """获取各面值可用卡密数量"""
+    """获取各面值可用卡密数量（带缓存）"""
+    key = _cache_key(db, STOCK_CACHE_KEY)
+    result = cache.backend.get_json(key)
+    if result is not None:
+        return result
+
     result = {}
-    for value in [10, 5, 3, 1]:
+    for value in CARD_VALUES:
         count = db.query(models.Card).filter(
             models.Card.value == value,
             models.Card.is_used == False
         ).count()
         result[str(value)] = count
+    cache.backend.set_json(key, result, config.STATS_CACHE_TTL)
     return result
 
 
@@ -188,7 +379,7 @@ def calculate_card_combination(target: int) -> Optional[Dict[int, int]]:
     remaining = target
     
     # 贪心：从大到小尝试
-    for value in [10, 5, 3, 1]:
+    for value in CARD_VALUES:
         if remaining >= value:
             count = remaining // value
             result[value] = count
@@ -203,17 +394,55 @@ def calculate_card_combination(target: int) -> Optional[Dict[int, int]]:
 def allocate_cards_for_user(
     db: Session, 
     user: models.User, 
-    combination: Dict[int, int]
+    combination: Dict[int, int],
+    timer=profiling.NULL_TIMER
 ) -> Optional[List[str]]:
     """
     为用户分配卡密
     
-    1. 检查库存是否充足
-    2. 标记卡密为已使用
-    3. 更新用户状态
+    1. 更新用户状态
+    2. 检查库存是否充足
+    3. 标记卡密为已使用
+
+    库存不足、或者用户已经被另一个请求领取过时返回 None（调用方可以看 user.has_claimed 区分）
+    timer 用来记录分配、写入、提交各花了多少时间（见 profiling.py）
     """
     import datetime
     
+    # 先更新用户状态：第一条 UPDATE 会拿到 SQLite 的写锁，提交之前别的请求都不能写，
+    # 后面挑卡密时就不会和别人挑中同一张；
+    # 而且只有数据库里仍是"未领取"才会更新成功，即使没有分布式锁（缓存后端不可用）也不会重复领取
+    with timer.phase("等待写锁"):
+        claimed = db.query(models.User).filter(
+            models.User.id == user.id,
+            models.User.has_claimed == False
+        ).update({"has_claimed": True, "claimed_at": datetime.datetime.now()}, synchronize_session=False)
+    if not claimed:
+        db.rollback()
+        return None
+    
+    with timer.phase("分配卡密"):
+        allocated_cards = _mark_cards_used(db, user, combination)
+    if allocated_cards is None:
+        db.rollback()
+        return None
+    
+    # flush 时才真正执行卡密的 UPDATE
+    with timer.phase("写入数据"):
+        db.flush()
+    with timer.phase("提交事务"):
+        db.commit()
+
+    # 领取成功后直接把"已领取"写进缓存，重复领取时不用再查数据库
+    _try_set_json(_user_cache_key(db, user.ycy_uid), user_snapshot(user), config.USER_CACHE_TTL)
+    _try_delete(_cache_key(db, STOCK_CACHE_KEY), _cache_key(db, USER_COUNTS_CACHE_KEY))
+    return allocated_cards
+
+
+def _mark_cards_used(db: Session, user: models.User, combination: Dict[int, int]) -> Optional[List[str]]:
+    """按组合挑选可用卡密并标记为已使用（不提交），库存不足时返回 None"""
+    import datetime
+    
     allocated_cards = []
     
     # 检查库存并分配
@@ -236,9 +465,61 @@ def allocate_cards_for_user(
             card.used_at = datetime.datetime.now()
             allocated_cards.append(card.code)
     
-    # 更新用户状态
-    user.has_claimed = True
-    user.claimed_at = datetime.datetime.now()
-    
-    db.commit()
     return allocated_cards
+
+
+def allocate_cards_for_batch(
+    db: Session,
+    claims: List[Tuple[models.User, Dict[int, int]]]
+) -> List[Optional[List[str]]]:
+    """
+    一次为一批用户分配卡密（不提交），供批量提交使用（见 group_commit.py）
+
+    每种面值只查询一次数据库，按顺序分给每个用户；
+    某个用户库存不足时返回 None，不会占用卡密，也不影响后面的用户
+    """
+    import datetime
+    
+    # 1. 统计这一批每种面值一共需要多少张，每种面值只查一次
+    demand = {}
+    for _, combination in claims:
+        for value, count in combination.items():
+            if count > 0:
+                demand[value] = demand.get(value, 0) + count
+    
+    pools = {}
+    for value, total in demand.items():
+        pools[value] = db.query(models.Card).filter(
+            models.Card.value == value,
+            models.Card.is_used == False
+        ).limit(total).all()
+    taken = {value: 0 for value in pools}
+    
+    # 2. 按顺序分配
+    now = datetime.datetime.now()
+    results = []
+    for user, combination in claims:
+        enough = all(
+            len(pools[value]) - taken[value] >= count
+            for value, count in combination.items() if count > 0
+        )
+        if not enough:
+            results.append(None)
+            continue
+        
+        allocated_cards = []
+        for value, count in combination.items():
+            if count <= 0:
+                continue
+            for card in pools[value][taken[value]:taken[value] + count]:
+                card.is_used = True
+                card.used_by = user.ycy_uid
+                card.used_at = now
+                allocated_cards.append(card.code)
+            taken[value] += count
+        
+        user.has_claimed = True
+        user.claimed_at = now
+        results.append(allocated_cards)
+    
+    return results
@@ -2,7 +2,7 @@
 # 这个文件负责设置数据库连接
 # 就像是建立通往仓库（数据库）的道路
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -32,3 +32,34 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# 开启 SQLite 的"增量回收空间"模式
+# 开启后删除数据腾出的空间可以随时一点点还给磁盘 (PRAGMA incremental_vacuum)，
+# 不需要停机做一次完整的 VACUUM
+# 新数据库（还没有表）在建表前直接开启，不需要额外操作；
+# 已有的旧数据库要做一次完整 VACUUM 才能切换，期间会锁住整个数据库，
+# 所以启动时只检查并提示，由管理员在空闲时调用 convert_to_incremental_vacuum（后台"维护"接口）
+def enable_incremental_vacuum(engine):
+    with engine.connect() as conn:
+        mode = conn.execute(text("PRAGMA auto_vacuum")).scalar()
+        if mode == 2:  # 2 = INCREMENTAL
+            return
+        has_tables = conn.execute(text("SELECT count(*) FROM sqlite_master WHERE type = 'table'")).scalar()
+        if not has_tables:
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            return
+    print(f"提示: {engine.url.database} 还没有开启增量回收空间，归档后不会释放磁盘空间，"
+          f"请在空闲时调用 POST /api/admin/maintenance/incremental-vacuum 切换")
+
+
+# 把已有的数据库切换到增量回收空间模式，已经是这个模式时返回 False
+# 需要做一次完整 VACUUM：数据库越大越慢，期间所有读写都要等待，请在没人领取时执行
+def convert_to_incremental_vacuum(engine) -> bool:
+    # VACUUM 不能在事务里执行，所以用自动提交模式
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return False
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+        return True
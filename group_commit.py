@@ -0,0 +1,128 @@
+# group_commit.py
+# =============================================
+# 批量提交 (Group Commit)
+# =============================================
+# SQLite 每提交一次事务都要等数据真正写到磁盘 (fsync)，
+# 所以"每个领取单独提交"时，每秒能处理的领取次数受限于磁盘速度。
+#
+# 开启批量提交后：
+# - 领取请求把自己交给一个专门的写入线程，然后等待结果
+# - 写入线程每攒够 GROUP_COMMIT_MAX_BATCH 个请求，或者等了 GROUP_COMMIT_MAX_DELAY_MS 毫秒，
+#   就把这一批放在同一个事务里处理，只提交（fsync）一次
+# - 提交成功后才把结果交还给每个请求，所以"返回成功 = 已经写入磁盘"这一点不变
+#
+# 每个活动（数据库文件）各有一个写入线程
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+import config
+import campaigns
+
+
+# 处理一批请求的函数: handler(会话, 这一批请求) -> 每个请求的结果（顺序一致）
+# 它可以修改数据，但不需要提交，提交由写入线程负责
+BatchHandler = Callable[[Session, List[Any]], List[Any]]
+
+
+class GroupCommitWriter:
+    """某个数据库的写入线程"""
+
+    def __init__(self, session_factory: sessionmaker, handler: BatchHandler, max_batch: int, max_delay: float):
+        self.session_factory = session_factory
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """
+        提交一个请求，返回 Future，调用 .result() 会一直等到这一批写入磁盘
+
+        还没开始处理的请求可以用 future.cancel() 取消，取消成功就一定不会被写入
+        """
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+
+            # 继续攒请求，直到攒够一批或者等待超时
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # 无论发生什么错误，写入线程都不能退出，否则之后的请求会一直等下去
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                print(f"批量提交错误: {e}")
+            finally:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("批量提交没有返回结果"))
+
+    def _commit_batch(self, batch: List[Tuple[Any, Future]]) -> None:
+        """在一个事务里处理整批请求，提交成功后再通知每个请求"""
+        # 标记为"处理中"，之后就不能再取消了；已经取消的请求（等待超时）直接丢掉
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        db = self.session_factory()
+        try:
+            results = self.handler(db, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"批量处理返回了 {len(results)} 个结果，应该是 {len(batch)} 个")
+            db.commit()
+        except Exception as e:
+            # 出错时整批回滚，这一批都没有写入
+            db.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+# {(活动名, 处理函数): 写入线程}
+_writers: Dict[Tuple[str, BatchHandler], GroupCommitWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(campaign: str, handler: BatchHandler) -> GroupCommitWriter:
+    """获取某个活动的写入线程，第一次使用时创建"""
+    key = (campaign, handler)
+    writer = _writers.get(key)
+    if writer is not None:
+        return writer
+
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = GroupCommitWriter(
+                campaigns.get_sessionmaker(campaign),
+                handler,
+                config.GROUP_COMMIT_MAX_BATCH,
+                config.GROUP_COMMIT_MAX_DELAY_MS / 1000,
+            )
+            _writers[key] = writer
+        return writer
@@ -4,26 +4,36 @@
 # =============================================
 # 这是整个系统的入口文件，负责定义所有的 API 接口
 
-from fastapi import FastAPI, Depends, HTTPException, status, Header, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Query, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.exc import OperationalError
+from typing import List, Optional, Union
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import uvicorn
 import os
+import csv
+import io
 
 import models
 import schemas
 import crud
 import database
 import config
+import planner
+import cache
+import profiling
+import archive
+import campaigns
+import group_commit
 
 # =============================================
 # 初始化
 # =============================================
 
-# 创建数据库表
-models.Base.metadata.create_all(bind=database.engine)
+# 打开所有活动的数据库（新数据库开启增量回收空间模式，并创建数据库表）
+campaigns.init_campaigns()
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -39,14 +49,26 @@ if not os.path.exists("static"):
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# 开启性能分析时，记录每个请求进入的时间
+if config.PROFILING_ENABLED:
+    app.add_middleware(profiling.RequestStartMiddleware)
+
 
 # =============================================
 # 依赖项（Dependency Injection）
 # =============================================
 
-def get_db():
-    """获取数据库会话"""
-    db = database.SessionLocal()
+def get_db(campaign: str = Query(campaigns.DEFAULT_CAMPAIGN, description="活动名称")):
+    """
+    获取数据库会话
+
+    通过 ?campaign=活动名 选择活动，不填时使用默认活动
+    每个活动有自己的数据库文件（见 campaigns.py）
+    """
+    session_factory = campaigns.get_sessionmaker(campaign)
+    if session_factory is None:
+        raise HTTPException(status_code=404, detail="活动不存在")
+    db = session_factory()
     try:
         yield db
     finally:
@@ -101,10 +123,163 @@ def claim_cards(request: schemas.ClaimRequest, db: Session = Depends(get_db)):
     3. 检查是否已领取
     4. 计算卡密组合
     5. 分配卡密
+
+    第 1~3 步先用缓存里的用户信息判断，
+    真正分配卡密时会加锁并重新从数据库读取，防止多个进程同时给同一个人发卡
+    缓存后端不可用时不限流、不加锁，直接以数据库为准逐个提交
+    """
+    timer = profiling.start_timer("/api/claim")
+    try:
+        return process_claim(request, db, timer)
+    finally:
+        timer.finish(f"uid={request.ycy_uid}")
+
+
+def process_claim(request: schemas.ClaimRequest, db: Session, timer) -> schemas.ClaimResult:
+    """领取流程的具体步骤，timer 用来记录每一步的耗时"""
+    if crud.hit_claim_rate_limit(db, request.ycy_uid):
+        return schemas.ClaimResult(
+            success=False,
+            message="操作太频繁了，请稍后再试",
+            nickname="",
+            zhihe_total=0
+        )
+
+    # 1~3. 先用缓存快速检查
+    with timer.phase("查询用户"):
+        snapshot = crud.get_user_snapshot(db, request.ycy_uid)
+    with timer.phase("校验密码"):
+        rejected = check_claim_allowed(snapshot, request)
+    if rejected:
+        return rejected
+
+    try:
+        with cache.backend.lock(f"claim:{crud.campaign_of(db)}:{request.ycy_uid}"):
+            if config.GROUP_COMMIT_ENABLED:
+                return claim_with_group_commit(db, request, snapshot, timer)
+            return claim_from_database(db, request, timer)
+    except cache.LockUnavailable as e:
+        # 没有锁时不走批量提交，逐个提交时数据库会拦下重复领取（见 crud.allocate_cards_for_user）
+        print(f"无法加锁，直接领取: {e.__cause__}")
+        return claim_from_database(db, request, timer)
+    except cache.LockTimeout:
+        return schemas.ClaimResult(
+            success=False,
+            message="当前领取人数较多，请稍后重试。",
+            nickname=snapshot["nickname"],
+            zhihe_total=snapshot["zhihe_count"]
+        )
+
+
+def claim_from_database(db: Session, request: schemas.ClaimRequest, timer) -> schemas.ClaimResult:
+    """从数据库重新读取用户，以数据库为准检查后分配卡密"""
+    with timer.phase("重新查询用户"):
+        user = crud.get_user_by_uid(db, request.ycy_uid)
+        rejected = check_claim_allowed(crud.user_snapshot(user) if user else None, request)
+    if rejected:
+        return rejected
+    return allocate_for_user(db, user, timer)
+
+
+def claim_with_group_commit(
+    db: Session,
+    request: schemas.ClaimRequest,
+    snapshot: dict,
+    timer
+) -> schemas.ClaimResult:
+    """批量提交模式：把分配操作交给写入线程，等这一批写入磁盘后再返回（见 group_commit.py）"""
+    writer = group_commit.get_writer(crud.campaign_of(db), claim_batch)
+
+    # 等待期间把数据库连接还回连接池，否则等待的请求会占满连接池，写入线程反而拿不到连接
+    db.close()
+    future = writer.submit(request)
+    try:
+        with timer.phase("等待批量提交"):
+            try:
+                result = future.result(timeout=config.GROUP_COMMIT_TIMEOUT_SECONDS)
+            except FutureTimeoutError:
+                # 还没轮到处理就取消掉，保证不会在告诉用户失败之后又偷偷领取成功
+                if future.cancel():
+                    return schemas.ClaimResult(
+                        success=False,
+                        message="当前领取人数较多，请稍后重试。",
+                        nickname=snapshot["nickname"],
+                        zhihe_total=snapshot["zhihe_count"]
+                    )
+                # 取消失败说明这一批已经在处理了，再等一会儿结果
+                result = future.result(timeout=config.GROUP_COMMIT_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        # 这一批还在处理，可能稍后才写入成功，清掉缓存，让用户重新领取时以数据库为准
+        print(f"领取超时: uid={request.ycy_uid}")
+        crud.invalidate_user_cache(db, request.ycy_uid)
+        crud.invalidate_stock_cache(db)
+        return schemas.ClaimResult(
+            success=False,
+            message="领取结果确认超时，请稍后重新提交查看是否已领取。",
+            nickname=snapshot["nickname"],
+            zhihe_total=snapshot["zhihe_count"]
+        )
+    except Exception as e:
+        print(f"领取错误: {e}")
+        return schemas.ClaimResult(
+            success=False,
+            message="领取过程中发生错误，请重试或联系管理员。",
+            nickname=snapshot["nickname"],
+            zhihe_total=snapshot["zhihe_count"]
+        )
+
+    if result.success:
+        crud.invalidate_user_cache(db, request.ycy_uid)
+        crud.invalidate_stock_cache(db)
+    return result
+
+
+def claim_batch(db: Session, requests: List[schemas.ClaimRequest]) -> List[schemas.ClaimResult]:
+    """
+    在写入线程里处理一批领取请求（不提交）
+
+    以数据库为准重新检查每个人，然后一次性为整批分配卡密
     """
+    users = crud.get_users_by_uids(db, [r.ycy_uid for r in requests])
+    results: List[Optional[schemas.ClaimResult]] = [None] * len(requests)
+    pending = []
+    seen = set()
+
+    for index, request in enumerate(requests):
+        user = users.get(request.ycy_uid)
+        rejected = check_claim_allowed(crud.user_snapshot(user) if user else None, request)
+        if rejected:
+            results[index] = rejected
+            continue
+
+        # 同一个UID在同一批里出现两次（正常情况下有锁，不会发生），只处理第一次
+        if request.ycy_uid in seen:
+            results[index] = schemas.ClaimResult(
+                success=False,
+                message="当前领取人数较多，请稍后重试。",
+                nickname=user.nickname,
+                zhihe_total=user.zhihe_count
+            )
+            continue
+        seen.add(request.ycy_uid)
+
+        combination = crud.calculate_card_combination(user.zhihe_count)
+        if combination is None:
+            results[index] = combination_error(user)
+            continue
+        pending.append((index, user, combination))
+
+    allocated = crud.allocate_cards_for_batch(db, [(user, combination) for _, user, combination in pending])
+    for (index, user, _), cards in zip(pending, allocated):
+        results[index] = allocation_result(user, cards)
+
+    return results
+
+
+def check_claim_allowed(snapshot: Optional[dict], request: schemas.ClaimRequest) -> Optional[schemas.ClaimResult]:
+    """检查用户是否存在、密码是否正确、是否已领取，不能领取时返回失败结果"""
     # 1. 查找用户
-    user = crud.get_user_by_uid(db, request.ycy_uid)
-    if not user:
+    if not snapshot:
         return schemas.ClaimResult(
             success=False,
             message="领取失败：找不到该易次元UID，请检查输入",
@@ -113,53 +288,48 @@ def claim_cards(request: schemas.ClaimRequest, db: Session = Depends(get_db)):
         )
     
     # 2. 验证密码
-    if user.qq != request.qq:
+    if snapshot["qq"] != request.qq:
         return schemas.ClaimResult(
             success=False,
             message="领取失败：QQ号(密码)错误，请重新输入",
-            nickname=user.nickname,
-            zhihe_total=user.zhihe_count
+            nickname=snapshot["nickname"],
+            zhihe_total=snapshot["zhihe_count"]
         )
     
     # 3. 检查是否已领取
-    if user.has_claimed:
-        return schemas.ClaimResult(
-            success=False,
-            message=f"你 ({user.nickname}) 已经领取过了，不能重复领取哦！",
-            nickname=user.nickname,
-            zhihe_total=user.zhihe_count
-        )
-    
+    if snapshot["has_claimed"]:
+        return already_claimed(snapshot["nickname"], snapshot["zhihe_count"])
+
+    return None
+
+
+def already_claimed(nickname: str, zhihe_total: int) -> schemas.ClaimResult:
+    """重复领取时的返回信息"""
+    return schemas.ClaimResult(
+        success=False,
+        message=f"你 ({nickname}) 已经领取过了，不能重复领取哦！",
+        nickname=nickname,
+        zhihe_total=zhihe_total
+    )
+
+
+def allocate_for_user(db: Session, user: models.User, timer=profiling.NULL_TIMER) -> schemas.ClaimResult:
+    """为已经通过检查的用户计算组合并分配卡密"""
     # 4. 计算卡密组合
     target = user.zhihe_count
-    combination = crud.calculate_card_combination(target)
+    with timer.phase("计算组合"):
+        combination = crud.calculate_card_combination(target)
     
     if combination is None:
-        return schemas.ClaimResult(
-            success=False,
-            message=f"系统错误：无法自动组合出 {target} 个纸鹤的卡密方案，请联系管理员。",
-            nickname=user.nickname,
-            zhihe_total=target
-        )
+        return combination_error(user)
     
     # 5. 分配卡密
     try:
-        cards = crud.allocate_cards_for_user(db, user, combination)
-        if cards is None:
-            return schemas.ClaimResult(
-                success=False,
-                message="很抱歉，当前库存不足，无法凑齐您所需的卡密。请联系作者补充库存！",
-                nickname=user.nickname,
-                zhihe_total=target
-            )
-        
-        return schemas.ClaimResult(
-            success=True,
-            message="领取成功！谢谢你的支持！",
-            nickname=user.nickname,
-            zhihe_total=target,
-            cards=cards
-        )
+        cards = crud.allocate_cards_for_user(db, user, combination, timer)
+        if cards is None and user.has_claimed:
+            # 另一个请求抢先领取了
+            return already_claimed(user.nickname, user.zhihe_count)
+        return allocation_result(user, cards)
     except Exception as e:
         print(f"领取错误: {e}")
         return schemas.ClaimResult(
@@ -170,6 +340,35 @@ def claim_cards(request: schemas.ClaimRequest, db: Session = Depends(get_db)):
         )
 
 
+def combination_error(user: models.User) -> schemas.ClaimResult:
+    """凑不出用户应得纸鹤数时的返回信息"""
+    return schemas.ClaimResult(
+        success=False,
+        message=f"系统错误：无法自动组合出 {user.zhihe_count} 个纸鹤的卡密方案，请联系管理员。",
+        nickname=user.nickname,
+        zhihe_total=user.zhihe_count
+    )
+
+
+def allocation_result(user: models.User, cards: Optional[List[str]]) -> schemas.ClaimResult:
+    """根据分配结果生成返回给用户的信息，cards 为 None 表示库存不足"""
+    if cards is None:
+        return schemas.ClaimResult(
+            success=False,
+            message="很抱歉，当前库存不足，无法凑齐您所需的卡密。请联系作者补充库存！",
+            nickname=user.nickname,
+            zhihe_total=user.zhihe_count
+        )
+    
+    return schemas.ClaimResult(
+        success=True,
+        message="领取成功！谢谢你的支持！",
+        nickname=user.nickname,
+        zhihe_total=user.zhihe_count,
+        cards=cards
+    )
+
+
 # =============================================
 # 管理员 API - 统计
 # =============================================
@@ -179,20 +378,109 @@ def get_stats(
     db: Session = Depends(get_db),
     _: bool = Depends(verify_admin_password)  # 密码验证
 ):
-    """获取系统统计数据"""
-    stocks = crud.get_available_cards_count(db)
-    total_users = db.query(models.User).count()
-    claimed_users = db.query(models.User).filter(models.User.has_claimed == True).count()
-    
+    """获取系统统计数据（当前活动）"""
     return {
-        "stock": stocks,
-        "users": {
-            "total": total_users,
-            "claimed": claimed_users
-        }
+        "campaign": crud.campaign_of(db),
+        "stock": crud.get_available_cards_count(db),
+        "users": crud.get_user_counts(db)
     }
 
 
+@app.get("/api/admin/stock-plan")
+def get_stock_plan(
+    db: Session = Depends(get_db),
+    _: bool = Depends(verify_admin_password)
+):
+    """
+    获取库存规划
+
+    根据未领取用户的纸鹤分布和当前库存，预测各面值还能支撑多少次领取，
+    给出低库存提醒以及面值替换方案（例如 5+5 代替 10）
+    """
+    return planner.build_stock_plan(db)
+
+
+@app.get("/api/admin/profile", response_class=PlainTextResponse)
+def profile_worker(
+    seconds: float = Query(5, gt=0, le=60),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    _: bool = Depends(verify_admin_password)
+):
+    """
+    对当前 worker 进程做一段时间的采样分析
+
+    返回火焰图工具可以直接读取的"折叠栈"文本，
+    保存成文件后用 flamegraph.pl 生成图片，或上传到 https://www.speedscope.app 查看
+    需要在 config.py 中开启 PROFILING_ENABLED
+    """
+    if not config.PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="未开启性能分析，请在 config.py 中设置 PROFILING_ENABLED = True")
+    try:
+        return profiling.sample_stacks(seconds, interval_ms / 1000)
+    except profiling.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="已经有一个采样分析正在进行，请稍后再试")
+
+
+# =============================================
+# 管理员 API - 活动管理
+# =============================================
+
+@app.get("/api/admin/campaigns")
+def list_campaigns(
+    _: bool = Depends(verify_admin_password)
+):
+    """列出所有活动以及各自的统计数据"""
+    result = []
+    for name in campaigns.list_campaigns():
+        db = campaigns.get_sessionmaker(name)()
+        try:
+            result.append({
+                "campaign": name,
+                "stock": crud.get_available_cards_count(db),
+                "users": crud.get_user_counts(db)
+            })
+        finally:
+            db.close()
+    return {"campaigns": result}
+
+
+@app.post("/api/admin/campaigns")
+def create_campaign(
+    request: schemas.CampaignCreate,
+    _: bool = Depends(verify_admin_password)
+):
+    """创建新活动（会新建一个独立的数据库文件）"""
+    if not campaigns.is_valid_name(request.name):
+        raise HTTPException(status_code=400, detail="活动名只能包含字母、数字、下划线和短横线，最长32个字符")
+    if not campaigns.create_campaign(request.name):
+        raise HTTPException(status_code=400, detail="活动已存在")
+    return {"message": f"成功创建活动 {request.name}"}
+
+
+# =============================================
+# 管理员 API - 维护
+# =============================================
+
+@app.post("/api/admin/maintenance/incremental-vacuum")
+def convert_incremental_vacuum(
+    db: Session = Depends(get_db),
+    _: bool = Depends(verify_admin_password)
+):
+    """
+    把当前活动的旧数据库切换到增量回收空间模式（只需要做一次）
+
+    会做一次完整 VACUUM，期间整个数据库被锁住，请在没人领取时执行
+    切换之后归档卡密腾出的空间才能还给磁盘（见 archive.py）
+    """
+    try:
+        converted = database.convert_to_incremental_vacuum(db.get_bind())
+    except OperationalError as e:
+        raise HTTPException(status_code=409, detail=f"数据库正忙，请稍后再试: {e.orig}")
+    if not converted:
+        return {"message": "已经是增量回收空间模式，不需要切换"}
+    return {"message": "已切换到增量回收空间模式"}
+
+
 # =============================================
 # 管理员 API - 用户管理
 # =============================================
@@ -242,6 +530,19 @@ def update_user(
     return {"message": "修改成功", "user": schemas.UserInfo.model_validate(user)}
 
 
+@app.get("/api/admin/users/{user_id}/cards", response_model=List[Union[schemas.CardInfo, schemas.ArchivedCardInfo]])
+def get_user_cards(
+    user_id: int,
+    db: Session = Depends(get_db),
+    _: bool = Depends(verify_admin_password)
+):
+    """查询某个用户领到的卡密（包括已归档的）"""
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return [card_info(c) for c in crud.get_cards_by_user(db, user.ycy_uid)]
+
+
 @app.delete("/api/admin/users/{user_id}")
 def delete_user(
     user_id: int,
@@ -259,19 +560,27 @@ def delete_user(
 # 管理员 API - 卡密管理
 # =============================================
 
+def card_info(card):
+    """卡密转换成返回给前端的格式，归档的卡密用 ArchivedCardInfo（没有可以拿去修改/删除的 id）"""
+    if isinstance(card, models.ArchivedCard):
+        return schemas.ArchivedCardInfo.model_validate(card)
+    return schemas.CardInfo.model_validate(card)
+
+
 @app.get("/api/admin/cards", response_model=schemas.CardListResponse)
 def list_cards(
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     value: Optional[int] = Query(None),
     used: Optional[bool] = Query(None),
+    archived: bool = Query(False),
     db: Session = Depends(get_db),
     _: bool = Depends(verify_admin_password)
 ):
-    """获取卡密列表（分页，可筛选）"""
-    cards, total = crud.get_cards_paginated(db, page, page_size, value, used)
+    """获取卡密列表（分页，可筛选，archived=true 时查看归档的卡密）"""
+    cards, total = crud.get_cards_paginated(db, page, page_size, value, used, archived)
     return schemas.CardListResponse(
-        cards=[schemas.CardInfo.model_validate(c) for c in cards],
+        cards=[card_info(c) for c in cards],
         total=total,
         page=page,
         page_size=page_size
@@ -289,6 +598,73 @@ def add_cards(
     return {"message": f"成功添加 {count} 张 {request.value}面值 的卡密"}
 
 
+@app.get("/api/admin/cards/export")
+def export_cards(
+    value: Optional[int] = Query(None),
+    used: Optional[bool] = Query(None),
+    db: Session = Depends(get_db),
+    _: bool = Depends(verify_admin_password)
+):
+    """
+    导出卡密为 CSV 文件（已使用的卡密包含归档数据）
+
+    边读边发送，卡密再多也不会一次性放进内存
+    """
+    session_factory = campaigns.get_sessionmaker(crud.campaign_of(db))
+    return StreamingResponse(
+        iter_cards_csv(session_factory, value, used),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=cards.csv"}
+    )
+
+
+def iter_cards_csv(session_factory, value: Optional[int], used: Optional[bool], chunk_rows: int = 1000):
+    """逐块生成 CSV 内容，每块 chunk_rows 行；使用自己的会话，因为请求的会话在开始发送前就可能被关闭"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["code", "value", "is_used", "used_by", "used_at", "archived"])
+
+    db = session_factory()
+    try:
+        for index, card in enumerate(crud.iter_cards_for_export(db, value, used), 1):
+            writer.writerow([
+                card.code,
+                card.value,
+                card.is_used,
+                card.used_by or "",
+                card.used_at.isoformat() if card.used_at else "",
+                isinstance(card, models.ArchivedCard),
+            ])
+            if index % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    finally:
+        db.close()
+    yield buffer.getvalue()
+
+
+@app.post("/api/admin/cards/archive")
+def archive_cards(
+    background_tasks: BackgroundTasks,
+    older_than_days: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db),
+    _: bool = Depends(verify_admin_password)
+):
+    """
+    归档已使用的旧卡密，然后在后台回收磁盘空间
+
+    分批进行，不需要停机，归档期间用户可以正常领取
+    不填 older_than_days 时使用 config.py 中的 ARCHIVE_AFTER_DAYS
+    """
+    count = archive.archive_used_cards(db, older_than_days)
+    background_tasks.add_task(
+        archive.reclaim_space_in_background,
+        campaigns.get_sessionmaker(crud.campaign_of(db))
+    )
+    return {"message": f"成功归档 {count} 张卡密，磁盘空间将在后台回收", "archived": count}
+
+
 @app.put("/api/admin/cards/{card_id}")
 def update_card(
     card_id: int,
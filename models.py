@@ -55,3 +55,31 @@ class Card(Base):
     
     # 使用时间
     used_at = Column(DateTime, nullable=True, comment="使用时间")
+
+
+# 归档卡密表模型
+# 已使用很久的卡密会从 cards 表搬到这里（见 archive.py），
+# 让 cards 表只保留"热"数据，分配和统计查询更快
+class ArchivedCard(Base):
+    __tablename__ = "cards_archive"
+
+    # 归档表自己的ID
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # 原来在 cards 表里的ID
+    # cards 表的ID在删除后可能被新卡密重新使用，所以这里不能设为唯一
+    card_id = Column(Integer, index=True, comment="原卡密ID")
+    
+    code = Column(String, unique=True, index=True, comment="卡密内容")
+    
+    value = Column(Integer, index=True, comment="面值")
+    
+    used_by = Column(String, nullable=True, index=True, comment="使用者UID")
+    
+    used_at = Column(DateTime, nullable=True, comment="使用时间")
+    
+    # 归档时间
+    archived_at = Column(DateTime, default=datetime.datetime.now, comment="归档时间")
+
+    # 归档的卡密一定是已使用的，方便和 Card 一样返回给前端
+    is_used = True
@@ -0,0 +1,221 @@
+# planner.py
+# =============================================
+# 库存规划 (低库存水位线 + 面值替换方案)
+# =============================================
+# 这个文件负责"提前预判"库存够不够用：
+# 把还没领取的用户按应得纸鹤数分组，和各面值的剩余库存对比，
+# 算出每种面值还能支撑多少次领取、哪些面值低于水位线、
+# 以及某种面值用完后可以用什么组合代替（例如用 5+5 代替 10）。
+
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
+import crud
+import config
+
+
+def calculate_card_combination_with_stock(target: int, stock: Dict[int, int]) -> Optional[Dict[int, int]]:
+    """
+    在"库存有限"的前提下计算凑出目标数字的卡密组合
+
+    - 优先使用大面值，和 crud.calculate_card_combination 的贪心结果一致
+    - 某种面值不够时，自动用小面值替换（例如 10 不够就用 5+5）
+    - 完全凑不出来时返回 None
+
+    思路：先决定 3 和 1 一共凑多少（记为 small），剩下的交给 10 和 5。
+    small 越小，10 和 5 用得越多，所以从小到大尝试 small。
+    small 必须和目标数字"除以 5 的余数"相同；没有 5 面值时要和"除以 10 的余数"相同。
+    3 面值够用时，需要补的 1 只取决于 small 除以 3 的余数，连续试 3 个就覆盖了所有余数；
+    3 面值不够用时，small 越大需要补的 1 越多，失败后就不用再试了。
+    所以无论目标数字多大，最多只需要尝试几次。
+    """
+    if target <= 0:
+        return None
+
+    s10, s5, s3, s1 = (stock.get(value, 0) for value in crud.CARD_VALUES)
+
+    step = 5 if s5 > 0 else 10
+    # 10 和 5 最多能凑出多少，small 至少要补上剩下的部分
+    lowest = max(0, target - (10 * s10 + 5 * s5))
+    first = lowest + (target - lowest) % step
+    highest = min(target, 3 * s3 + s1)
+
+    misses = 0
+    for small in range(first, highest + 1, step):
+        c3 = min(s3, small // 3)
+        c1 = small - c3 * 3
+        if c1 <= s1:
+            big = target - small
+            c10 = min(s10, big // 10)
+            c5 = (big - c10 * 10) // 5
+            return {10: c10, 5: c5, 3: c3, 1: c1}
+
+        misses += 1
+        if small // 3 >= s3 or misses >= 3:
+            break
+
+    return None
+
+
+def _claims_affordable(combination: Dict[int, int], stock: Dict[int, int]) -> int:
+    """按照某个组合，当前库存最多还能满足多少次领取"""
+    counts = [stock[value] // count for value, count in combination.items() if count > 0]
+    return min(counts) if counts else 0
+
+
+def _simulate_default_claims(
+    distribution: Dict[int, int],
+    default_combinations: Dict[int, Optional[Dict[int, int]]],
+    stock: Dict[int, int],
+    largest_first: bool
+) -> Tuple[int, Dict[int, int], Dict[int, int]]:
+    """
+    按实际领取规则（只用默认组合）模拟所有人领取
+
+    领取顺序会影响结果，这里按纸鹤数从小到大（或从大到小）依次领取
+    返回 (成功人数, 剩下的库存, {纸鹤数: 失败人数})
+    """
+    pool = dict(stock)
+    success = 0
+    leftover = {}
+
+    for target in sorted(distribution, reverse=largest_first):
+        default = default_combinations[target]
+        if default is None:
+            continue
+
+        served = min(distribution[target], _claims_affordable(default, pool))
+        for value, count in default.items():
+            pool[value] -= count * served
+        success += served
+        leftover[target] = distribution[target] - served
+
+    return success, pool, leftover
+
+
+def build_stock_plan(db: Session) -> dict:
+    """
+    生成库存规划报告
+
+    返回内容:
+    - values: 每种面值的库存、预计需求、缺口、还能支撑的领取次数、是否低于水位线
+    - projected_success / projected_failures: 按当前领取规则（贪心组合，不替换面值）、
+      纸鹤数少的人先领时，预计能成功/因库存不足失败的人数
+      实际结果取决于领取顺序，这是比较乐观的估计
+    - projected_success_large_first: 纸鹤数多的人先领时预计能成功的人数（比较悲观的估计）
+    - substitutions: 领取失败的人里，换成其它面值组合后库存就够用的方案
+      （领取接口不会自动替换，需要管理员补充对应面值或手动发放）
+    - substitutable_users / unrecoverable_users: 失败的人里能/不能靠替换面值解决的人数
+    - unsolvable_users: 应得纸鹤数无效（小于等于 0），领取时会提示无法自动组合，不算在失败人数里
+    - alerts: 需要管理员注意的提示
+    """
+    distribution = crud.get_pending_zhihe_distribution(db)
+    available = crud.get_available_cards_count(db)
+    stock = {value: available[str(value)] for value in crud.CARD_VALUES}
+
+    pending_users = sum(distribution.values())
+    demand = {value: 0 for value in crud.CARD_VALUES}
+    users_needing = {value: 0 for value in crud.CARD_VALUES}
+    unsolvable_users = 0
+
+    # 1. 按默认（贪心）组合统计每种面值的总需求
+    default_combinations = {}
+    for target, users in distribution.items():
+        combination = crud.calculate_card_combination(target)
+        default_combinations[target] = combination
+        if combination is None:
+            unsolvable_users += users
+            continue
+        for value, count in combination.items():
+            if count > 0:
+                demand[value] += count * users
+                users_needing[value] += users
+
+    # 2. 按实际领取规则模拟发放：只使用默认组合
+    projected_success, pool, leftover = _simulate_default_claims(
+        distribution, default_combinations, stock, largest_first=False
+    )
+    projected_success_large_first, _, _ = _simulate_default_claims(
+        distribution, default_combinations, stock, largest_first=True
+    )
+
+    # 3. 领取失败的人，用剩下的库存尝试替换面值
+    substitutions: List[dict] = []
+    substitutable_users = 0
+
+    for target, remaining in leftover.items():
+        default = default_combinations[target]
+        while remaining > 0:
+            combination = calculate_card_combination_with_stock(target, pool)
+            if combination is None:
+                break
+
+            served = min(remaining, _claims_affordable(combination, pool))
+            for value, count in combination.items():
+                pool[value] -= count * served
+            remaining -= served
+            substitutable_users += served
+            substitutions.append({
+                "zhihe": target,
+                "users": served,
+                "default": {str(v): c for v, c in default.items() if c > 0},
+                "substitute": {str(v): c for v, c in combination.items() if c > 0},
+            })
+
+    # 4. 每种面值的规划结果 + 水位线告警
+    values = {}
+    alerts = []
+    for value in crud.CARD_VALUES:
+        watermark = config.LOW_STOCK_WATERMARKS.get(value, 0)
+        shortfall = max(0, demand[value] - stock[value])
+
+        # 假设各类用户按比例领取，这种面值能撑到多少人
+        if demand[value] > 0:
+            claims_coverable = min(users_needing[value], stock[value] * users_needing[value] // demand[value])
+        else:
+            claims_coverable = 0
+
+        low = stock[value] < watermark
+        values[str(value)] = {
+            "stock": stock[value],
+            "demand": demand[value],
+            "shortfall": shortfall,
+            "claims_needing": users_needing[value],
+            "claims_coverable": claims_coverable,
+            "watermark": watermark,
+            "low": low,
+        }
+
+        if low:
+            alerts.append(f"{value}面值库存 {stock[value]} 张，低于水位线 {watermark} 张")
+        if shortfall > 0:
+            alerts.append(f"{value}面值预计缺口 {shortfall} 张，约 {users_needing[value] - claims_coverable} 人会受影响")
+
+    projected_failures = pending_users - unsolvable_users - projected_success
+    unrecoverable_users = projected_failures - substitutable_users
+    if projected_failures > 0:
+        alerts.append(f"按当前库存，预计有 {projected_failures} 人领取时会提示库存不足")
+    if projected_success_large_first < projected_success:
+        alerts.append(
+            f"如果纸鹤数多的人先领，成功人数可能只有 {projected_success_large_first} 人"
+            f"（{pending_users - unsolvable_users - projected_success_large_first} 人库存不足）"
+        )
+    if substitutable_users > 0:
+        alerts.append(f"其中 {substitutable_users} 人换成其它面值组合后库存够用，请补充对应面值或手动发放")
+    if unrecoverable_users > 0:
+        alerts.append(f"即使替换面值，仍有 {unrecoverable_users} 人无法领取，请补充库存")
+    if unsolvable_users > 0:
+        alerts.append(f"有 {unsolvable_users} 人的应得纸鹤数小于等于 0，领取时会提示无法自动组合，请检查用户数据")
+
+    return {
+        "pending_users": pending_users,
+        "pending_zhihe": sum(target * users for target, users in distribution.items()),
+        "values": values,
+        "substitutions": substitutions,
+        "projected_success": projected_success,
+        "projected_success_large_first": projected_success_large_first,
+        "projected_failures": projected_failures,
+        "substitutable_users": substitutable_users,
+        "unrecoverable_users": unrecoverable_users,
+        "unsolvable_users": unsolvable_users,
+        "alerts": alerts,
+    }
@@ -0,0 +1,148 @@
+# profiling.py
+# =============================================
+# 性能分析工具 (默认关闭)
+# =============================================
+# 这个文件提供三样东西，用来排查 /api/claim 变慢的原因：
+# 1. PhaseTimer: 记录领取流程中每一步花了多少时间
+# 2. 慢请求日志: 超过阈值的请求会把每一步的耗时打印出来
+# 3. sample_stacks: 采样分析器，定时抓取所有线程的调用栈，
+#    输出火焰图工具 (flamegraph.pl / speedscope) 能直接读取的格式
+#
+# 在 config.py 中设置 PROFILING_ENABLED = True 才会生效，
+# 关闭时领取流程使用的是什么都不做的 NULL_TIMER
+
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+import config
+
+
+# 请求进入服务器的时间，由 RequestStartMiddleware 写入
+# 用来计算"排队"耗时：请求体解析、依赖项、等待线程池都算在这里
+request_started_at: ContextVar[Optional[float]] = ContextVar("request_started_at", default=None)
+
+
+class PhaseTimer:
+    """记录一次请求中每个阶段的耗时"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+        received_at = request_started_at.get()
+        if received_at is not None:
+            self.phases.append(("排队", self.started_at - received_at))
+            self.started_at = received_at
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def report(self) -> str:
+        """生成一行耗时明细，例如 "查询用户 1.2ms, 分配卡密 30.5ms" """
+        return ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.phases)
+
+    def finish(self, detail: str = "") -> None:
+        """请求结束时调用，超过慢请求阈值就打印日志"""
+        total = self.total_ms()
+        if total >= config.SLOW_REQUEST_MS:
+            print(f"[慢请求] {self.name} 总耗时 {total:.1f}ms {detail} | {self.report()}")
+
+
+class _NullTimer:
+    """关闭性能分析时使用的计时器，所有方法都不做任何事"""
+
+    _context = nullcontext()
+
+    def phase(self, name: str):
+        return self._context
+
+    def finish(self, detail: str = "") -> None:
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+def start_timer(name: str):
+    """开始计时，关闭性能分析时返回 NULL_TIMER"""
+    if config.PROFILING_ENABLED:
+        return PhaseTimer(name)
+    return NULL_TIMER
+
+
+class RequestStartMiddleware:
+    """记录请求进入服务器的时间（只在开启性能分析时注册）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            request_started_at.set(time.perf_counter())
+        await self.app(scope, receive, send)
+
+
+# =============================================
+# 采样分析器
+# =============================================
+
+# 同一时间只允许运行一个采样任务
+_sampling_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """已经有一个采样任务在运行"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def sample_stacks(seconds: float, interval: float) -> str:
+    """
+    对当前进程做采样分析
+
+    每隔 interval 秒抓取一次所有线程（除了自己）的调用栈，持续 seconds 秒
+    返回 "折叠栈" 格式: 每行是 "最外层;...;最内层 次数"
+    可以直接交给 flamegraph.pl 或上传到 https://www.speedscope.app 查看
+    """
+    if not _sampling_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+
+    try:
+        own_thread = threading.get_ident()
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: Counter = Counter()
+        deadline = time.perf_counter() + seconds
+
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(thread_names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    finally:
+        _sampling_lock.release()
@@ -4,8 +4,8 @@
 # =============================================
 # 这些类定义了前端和后端之间传递数据的格式
 
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional, Union
 from datetime import datetime
 
 
@@ -83,6 +83,27 @@ class CardInfo(BaseModel):
     is_used: bool
     used_by: Optional[str] = None
     used_at: Optional[datetime] = None
+    archived: bool = False
+
+
+class ArchivedCardInfo(BaseModel):
+    """
+    已归档的卡密信息（返回给前端）
+
+    故意没有 id 字段：归档表的ID和 cards 表的ID会重复，
+    不能拿去调用修改/删除卡密的接口
+    """
+    model_config = ConfigDict(from_attributes=True)
+    
+    archived_id: int = Field(validation_alias="id")   # 归档表自己的ID
+    card_id: Optional[int] = None                      # 归档前在 cards 表里的ID（可能已被新卡密重新使用）
+    code: str
+    value: int
+    is_used: bool = True
+    used_by: Optional[str] = None
+    used_at: Optional[datetime] = None
+    archived_at: Optional[datetime] = None
+    archived: bool = True
 
 
 class CardAddRequest(BaseModel):
@@ -100,7 +121,16 @@ class CardUpdate(BaseModel):
 
 class CardListResponse(BaseModel):
     """卡密列表响应"""
-    cards: List[CardInfo]
+    cards: List[Union[CardInfo, ArchivedCardInfo]]
     total: int
     page: int
     page_size: int
+
+
+# =============================================
+# 活动管理相关
+# =============================================
+
+class CampaignCreate(BaseModel):
+    """创建活动请求"""
+    name: str         # 活动名，只能包含字母、数字、下划线和短横线
@@ -0,0 +1,241 @@
+# smoke_cache.py
+# =============================================
+# 缓存后端冒烟测试
+# =============================================
+# 对 LocalBackend 和 RedisBackend 跑同一组检查：get / set / add / incr / lock
+# RedisBackend 连接的是这里自带的一个极简 Redis 协议服务（RespStandIn），
+# 不需要真的安装 Redis，只实现了 cache.py 用到的那几个命令
+#
+# 另外检查两种出错情况：
+# - 命令已经执行、但回复之前连接断开：不能重发（否则 INCRBY 会加两次）
+# - 密码错误：连接不能被留下来给后面的命令使用
+#
+# 用法: python smoke_cache.py
+
+import os
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cache
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """
+    极简的 Redis 协议服务，只用于测试
+
+    支持 AUTH / SELECT / GET / SET (NX, PX) / DEL / INCRBY / PEXPIRE，
+    EVAL 只认识 RedisBackend 里的两段脚本
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, password=None):
+        super().__init__(("127.0.0.1", 0), _RespHandler)
+        self.password = password
+        self.data = {}
+        self.mutex = threading.Lock()
+        # 执行完这些命令后不回复、直接断开连接（每个只生效一次）
+        self.drop_after = set()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{host}:{port}/1"
+
+    def _alive(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _incr(self, key, amount):
+        value = int(self._alive(key) or 0) + amount
+        expires_at = self.data[key][1] if key in self.data else None
+        self.data[key] = (str(value), expires_at)
+        return value
+
+    def _pexpire(self, key, ms):
+        if self._alive(key) is None:
+            return 0
+        self.data[key] = (self.data[key][0], time.monotonic() + ms / 1000)
+        return 1
+
+    def run(self, args):
+        command = args[0].upper()
+        if command == "GET":
+            return self._alive(args[1])
+        if command == "SET":
+            key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+            if "NX" in options and self._alive(key) is not None:
+                return None
+            expires_at = None
+            if "PX" in options:
+                expires_at = time.monotonic() + int(args[3 + options.index("PX") + 1]) / 1000
+            self.data[key] = (value, expires_at)
+            return "OK"
+        if command == "DEL":
+            return sum(1 for key in args[1:] if self._alive(key) is not None and self.data.pop(key))
+        if command == "INCRBY":
+            return self._incr(args[1], int(args[2]))
+        if command == "PEXPIRE":
+            return self._pexpire(args[1], int(args[2]))
+        if command == "EVAL":
+            script, key, extra = args[1], args[3], args[4:]
+            if script == cache.RedisBackend._INCR_WITH_TTL:
+                value = self._incr(key, int(extra[0]))
+                if value == int(extra[0]) and int(extra[1]) > 0:
+                    self._pexpire(key, int(extra[1]))
+                return value
+            if script == cache.RedisBackend._DELETE_IF_EQUALS:
+                if self._alive(key) == extra[0]:
+                    del self.data[key]
+                    return 1
+                return 0
+        raise ValueError(f"ERR unknown command '{command}'")
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if value == "OK":
+            return b"+OK\r\n"
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def handle(self):
+        server = self.server
+        authed = server.password is None
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+
+            if command == "AUTH":
+                authed = args[1] == server.password
+                self.wfile.write(b"+OK\r\n" if authed else b"-WRONGPASS invalid password\r\n")
+                continue
+            if not authed:
+                self.wfile.write(b"-NOAUTH Authentication required.\r\n")
+                continue
+            if command == "SELECT":
+                self.wfile.write(b"+OK\r\n")
+                continue
+
+            with server.mutex:
+                try:
+                    reply = self._encode(server.run(args))
+                except ValueError as e:
+                    reply = b"-%s\r\n" % str(e).encode("utf-8")
+                drop = command in server.drop_after
+                server.drop_after.discard(command)
+            if drop:
+                return
+            self.wfile.write(reply)
+
+
+def check_backend(name: str, backend: cache.CacheBackend) -> None:
+    assert backend.get("k") is None
+    backend.set("k", "v")
+    assert backend.get("k") == "v"
+    backend.set_json("j", {"a": [1, "二"]})
+    assert backend.get_json("j") == {"a": [1, "二"]}
+    backend.set("short", "x", ttl=0.05)
+    time.sleep(0.1)
+    assert backend.get("short") is None
+    backend.delete("k", "j")
+    assert backend.get("k") is None
+
+    assert backend.add("once", "1")
+    assert not backend.add("once", "2")
+    assert backend.get("once") == "1"
+
+    assert backend.incr("n") == 1
+    assert backend.incr("n", 5) == 6
+    assert backend.incr("rate", ttl=0.05) == 1
+    assert backend.incr("rate", ttl=0.05) == 2
+    time.sleep(0.1)
+    assert backend.incr("rate", ttl=0.05) == 1
+
+    with backend.lock("l", timeout=5, wait=1):
+        try:
+            with backend.lock("l", timeout=5, wait=0.05):
+                raise AssertionError("同一把锁被拿到了两次")
+        except cache.LockTimeout:
+            pass
+        assert not backend.delete_if_equals("lock:l", "别人的 token")
+    with backend.lock("l", wait=0.05):
+        pass
+
+    print(f"{name}: get/set/add/incr/lock 正常")
+
+
+def check_no_retry_after_send() -> None:
+    server = RespStandIn()
+    backend = cache.RedisBackend(server.url)
+    assert backend.incr("n") == 1
+
+    server.drop_after.add("INCRBY")
+    try:
+        backend.incr("n")
+        raise AssertionError("连接断开时应该抛出异常")
+    except (ConnectionError, OSError):
+        pass
+    # 服务端已经执行了一次，客户端不能再发一次
+    assert server.data["n"][0] == "2", server.data["n"]
+    # 下一条命令会重新连接
+    assert backend.incr("n") == 3
+    server.shutdown()
+    print("RedisBackend: 命令发出后断线不会重发")
+
+
+def check_failed_auth_not_cached() -> None:
+    server = RespStandIn(password="secret")
+    backend = cache.RedisBackend(server.url.replace("secret", "wrong"))
+    for _ in range(2):
+        try:
+            backend.get("k")
+            raise AssertionError("密码错误时应该抛出异常")
+        except RuntimeError as e:
+            assert "WRONGPASS" in str(e), e
+        assert getattr(backend._local, "conn", None) is None
+    server.shutdown()
+    print("RedisBackend: 认证失败的连接不会被复用")
+
+
+if __name__ == "__main__":
+    check_backend("LocalBackend", cache.LocalBackend())
+
+    server = RespStandIn(password="secret")
+    check_backend("RedisBackend", cache.RedisBackend(server.url))
+    server.shutdown()
+
+    check_no_retry_after_send()
+    check_failed_auth_not_cached()
+    print("全部通过")
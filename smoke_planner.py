@@ -0,0 +1,100 @@
+# smoke_planner.py
+# =============================================
+# 面值替换算法冒烟测试
+# =============================================
+# planner.calculate_card_combination_with_stock 只尝试很少几个候选就给出结果，
+# 这里用最直接的穷举法逐个对比，确认两者在大量随机库存下结果完全一致：
+# - 穷举法：10 从多到少、5 从多到少依次尝试，剩下的尽量用 3，最后用 1 补齐，第一个凑得出的就是答案
+#   （也就是"优先使用大面值"的字面意思）
+# - 库存充足时，结果要和 crud.calculate_card_combination 的贪心组合一样
+# - 目标数字和库存很大时也要很快算完
+#
+# 用法: python smoke_planner.py [随机测试次数]
+# 例如: python smoke_planner.py 100000
+
+import os
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import crud
+import planner
+
+
+def brute_force(target: int, stock: Dict[int, int]) -> Optional[Dict[int, int]]:
+    """穷举所有 10 和 5 的张数，返回第一个凑得出来的组合"""
+    if target <= 0:
+        return None
+    for c10 in range(min(stock[10], target // 10), -1, -1):
+        rest = target - 10 * c10
+        for c5 in range(min(stock[5], rest // 5), -1, -1):
+            small = rest - 5 * c5
+            c3 = min(stock[3], small // 3)
+            c1 = small - 3 * c3
+            if c1 <= stock[1]:
+                return {10: c10, 5: c5, 3: c3, 1: c1}
+    return None
+
+
+def random_stock(rng: random.Random) -> Dict[int, int]:
+    # 经常让某种面值为 0 或很少，这些是最容易出错的情况
+    stock = {}
+    for value in crud.CARD_VALUES:
+        kind = rng.random()
+        if kind < 0.2:
+            stock[value] = 0
+        elif kind < 0.5:
+            stock[value] = rng.randint(1, 3)
+        else:
+            stock[value] = rng.randint(0, 40)
+    return stock
+
+
+def check_random(cases: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for _ in range(cases):
+        target = rng.randint(-2, 250)
+        stock = random_stock(rng)
+        expected = brute_force(target, stock)
+        actual = planner.calculate_card_combination_with_stock(target, stock)
+        assert actual == expected, (target, stock, actual, expected)
+    print(f"随机库存: {cases} 次结果和穷举法一致")
+
+
+def check_matches_greedy() -> None:
+    plenty = {value: 10 ** 6 for value in crud.CARD_VALUES}
+    for target in range(-2, 1000):
+        expected = crud.calculate_card_combination(target)
+        actual = planner.calculate_card_combination_with_stock(target, plenty)
+        assert actual == expected, (target, actual, expected)
+    print("库存充足: 结果和贪心组合一致")
+
+
+def check_large_inputs() -> None:
+    cases = [
+        (99999, {10: 5000, 5: 5000, 3: 0, 1: 0}),
+        (999999, {10: 200000, 5: 200000, 3: 0, 1: 1}),
+        (999998, {10: 0, 5: 0, 3: 10 ** 6, 1: 10 ** 6}),
+        (10 ** 7 + 7, {10: 10 ** 5, 5: 0, 3: 10 ** 6, 1: 2}),
+    ]
+    start = time.perf_counter()
+    for target, stock in cases:
+        result = planner.calculate_card_combination_with_stock(target, stock)
+        if result is not None:
+            assert sum(value * count for value, count in result.items()) == target
+            assert all(result[value] <= stock[value] for value in crud.CARD_VALUES)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.1, elapsed
+    print(f"大数字: {len(cases)} 个用例共 {elapsed * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    check_random(cases)
+    check_matches_greedy()
+    check_large_inputs()
+    print("全部通过")
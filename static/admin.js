@@ -75,6 +75,12 @@ async function verifyAndInit() {
 // =============================================
 
 async function apiCall(url, method = 'GET', body = null) {
+    // 后台地址带有 ?campaign=活动名 时，管理对应活动的数据
+    const campaign = new URLSearchParams(window.location.search).get('campaign');
+    if (campaign) {
+        url += (url.includes('?') ? '&' : '?') + `campaign=${encodeURIComponent(campaign)}`;
+    }
+
     const options = {
         method: method,
         headers: {
@@ -29,7 +29,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             // 3. 向后端发送请求
-            const response = await fetch('/api/claim', {
+            // 页面地址带有 ?campaign=活动名 时，领取对应活动的卡密
+            const campaign = new URLSearchParams(window.location.search).get('campaign');
+            const claimUrl = campaign ? `/api/claim?campaign=${encodeURIComponent(campaign)}` : '/api/claim';
+            const response = await fetch(claimUrl, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'